@@ -0,0 +1,113 @@
+import pandas as pd
+from functools import lru_cache
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+# postcode,suburb,state for every Australian locality (16,873 rows), from the GeoNames postal code
+# dump for AU (CC BY 4.0, geonames.org) - see README for provenance and how to refresh it
+POSTCODES_PATH = BASE_DIR / "au_postcodes.csv"
+
+STATE_NAMES = {
+    "ACT": "Australian Capital Territory",
+    "NSW": "New South Wales",
+    "NT": "Northern Territory",
+    "QLD": "Queensland",
+    "SA": "South Australia",
+    "TAS": "Tasmania",
+    "VIC": "Victoria",
+    "WA": "Western Australia",
+}
+STATE_CODES = {**{k: k for k in STATE_NAMES}, **{v.upper(): k for k, v in STATE_NAMES.items()}}
+
+EXCEPTION_COLUMNS = ["D.O. No.", "Address 1", "Suburb", "State", "Postal Code", "Issue"]
+
+@lru_cache(maxsize=None)
+def load_postcode_index() -> dict:
+    """Lookup tables built once per process from the bundled locality list.
+
+    postcodes: every known postcode; states: (Postcode, State) pairs; localities:
+    (Postcode, State, Suburb) triples; default_states: Postcode -> State for postcodes
+    that belong to a single state.
+    """
+    raw = pd.read_csv(POSTCODES_PATH, dtype=str, keep_default_na=False)
+    localities = pd.DataFrame({
+        "Postcode": normalize_postcode(raw["postcode"]),
+        "State": to_state_code(raw["state"]),
+        "Suburb": normalize_suburb(raw["suburb"]),
+    }).drop_duplicates(ignore_index=True)
+    states = localities[["Postcode", "State"]].drop_duplicates(ignore_index=True)
+    single = states["Postcode"].map(states["Postcode"].value_counts()) == 1
+    return {
+        "postcodes": pd.Index(states["Postcode"].unique()),
+        "states": states.assign(_state_ok=True),
+        "localities": localities.assign(_suburb_ok=True),
+        "default_states": states[single].set_index("Postcode")["State"],
+    }
+
+def normalize_postcode(values: pd.Series) -> pd.Series:
+    digits = values.fillna("").astype(str).str.replace(r"\.0$", "", regex=True).str.replace(r"\D", "", regex=True)
+    # Leading zeros (NT/ACT) are often lost when the export passes through Excel
+    return digits.where(digits.str.len() != 3, digits.str.zfill(4))
+
+def normalize_suburb(values: pd.Series) -> pd.Series:
+    return values.fillna("").astype(str).str.upper().str.replace(r"\s+", " ", regex=True).str.strip()
+
+def to_state_code(values: pd.Series) -> pd.Series:
+    raw = values.fillna("").astype(str).str.strip().str.upper()
+    return raw.map(STATE_CODES).fillna(raw)
+
+def normalize_addresses(df: pd.DataFrame,
+                        postcode_col: str = "Postal Code",
+                        state_col: str = "State",
+                        suburb_col: str = "Address 2") -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Normalize postcodes/states against the reference index in one pass.
+
+    Returns the manifest with cleaned postcodes and full state names (blank states are
+    filled from the postcode when it belongs to a single state) plus a frame of the rows
+    whose postcode, state or suburb don't agree with the locality list, ready to write
+    as an exceptions sheet.
+    """
+    if df.empty:
+        return df, pd.DataFrame(columns=EXCEPTION_COLUMNS)
+
+    index = load_postcode_index()
+    out = df.copy()
+    # Keep what the customer typed for the exceptions sheet; only the cleaned form is joined
+    raw_postcode = out[postcode_col].fillna("").astype(str).str.strip()
+    raw_postcode = raw_postcode.mask(raw_postcode.str.lower().isin(["nan", "none", "null"]), "")
+    postcode = normalize_postcode(raw_postcode)
+    state = to_state_code(out[state_col])
+    state = state.where(state != "", postcode.map(index["default_states"]).fillna(""))
+    suburb = normalize_suburb(out[suburb_col])
+
+    # One pass of hash joins: the state must belong to the postcode, and the suburb to that postcode *and* state
+    keys = pd.DataFrame({"Postcode": postcode, "State": state, "Suburb": suburb})
+    checked = keys.merge(index["states"], on=["Postcode", "State"], how="left").merge(
+        index["localities"], on=["Postcode", "State", "Suburb"], how="left")
+    checked.index = out.index
+
+    known = postcode.isin(index["postcodes"])
+    state_ok = checked["_state_ok"].notna()
+    suburb_ok = checked["_suburb_ok"].notna()
+
+    issue = pd.Series("", index=out.index)
+    suburb_text = out[suburb_col].fillna("").astype(str).str.strip()
+    issue = issue.mask(known & ~suburb_ok, "Suburb " + suburb_text.mask(suburb_text == "", "(blank)") + " is not in postcode " + postcode + " " + state)
+    issue = issue.mask(known & ~state_ok, "State " + state.mask(state == "", "(blank)") + " does not match postcode " + postcode)
+    issue = issue.mask(~known, "Unknown postcode " + raw_postcode)
+    issue = issue.mask(raw_postcode == "", "Missing postcode")
+
+    # Only overwrite the postcode when the cleaned value is a real one; otherwise leave the input as-is
+    out[postcode_col] = postcode.where(known, out[postcode_col])
+    out[state_col] = state.map(STATE_NAMES).fillna(out[state_col])
+
+    flagged = issue != ""
+    exceptions = pd.DataFrame({
+        "D.O. No.": df.loc[flagged, "D.O. No."],
+        "Address 1": df.loc[flagged, "Address 1"],
+        "Suburb": df.loc[flagged, suburb_col],
+        "State": df.loc[flagged, state_col],
+        "Postal Code": raw_postcode[flagged],
+        "Issue": issue[flagged],
+    }, columns=EXCEPTION_COLUMNS)
+    return out, exceptions.reset_index(drop=True)
@@ -6,13 +6,30 @@ from io import BytesIO
 import re
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
+from address_reference import normalize_addresses, STATE_CODES
 from openpyxl import load_workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
-from tempfile import NamedTemporaryFile
+from tempfile import TemporaryDirectory
 from pathlib import Path
+import pyarrow as pa
+import xlsxwriter
 
 NAN_LIKE = {"nan", "none", "null", ""}
 
+EXPECTED_COLS = [
+    "Notes","Tags","Shipping Phone","Shipping Street","Shipping City","Shipping Zip",
+    "Shipping Province","Shipping Country","Shipping Name","Shipping Company","Email",
+    "Name","Lineitem name","Lineitem quantity"
+]
+BUNDLE_ITEMS = [
+    "CARB LOVER'S FEAST","SUPER CHARGED CALORIES","FEED ME BEEF","GIVE ME CHICKEN",
+    "I WON'T PAS(TA) ON THIS MEAL","THE MEGA PACK","MAKE YOUR OWN MEGA PACK",
+    "CARB HATERS FEAST","UNDER CHARGED CALORIES","VEGGIE LOVERS PACK","Clean Eats Meal Plan"
+]
+FAMILY_DOUBLE_ITEMS = ["Family Mac and 3 Cheese Pasta Bake","Baked Family Lasagna"]
+TEXT_COLS = ["Phone No.","Postal Code"]
+# Rows per CSV chunk / Arrow record batch in backfill mode
+BACKFILL_CHUNK_ROWS = 50_000
+
 def clean_cell(x: object) -> str:
     if x is None or (isinstance(x, float) and pd.isna(x)):
         return ""
@@ -48,35 +65,15 @@ def format_phone(phone: object) -> str:
         p = "0" + p
     return p
 
-def run():
-    st.markdown("### Clean Eats Manifest Generator")
-
-    uploaded_file = st.file_uploader("Upload Clean Eats orders_export CSV file", type="csv")
-    generate = st.button("Generate Clean Eats Manifests")
-
-    if not (uploaded_file and generate):
-        return
-
-    orders_df = pd.read_csv(uploaded_file, dtype=str, keep_default_na=False)
+def prepare_orders(orders_df: pd.DataFrame) -> pd.DataFrame:
     orders_df = orders_df.map(clean_cell)
     orders_df.columns = orders_df.columns.str.strip()
-
-    expected_cols = [
-        "Notes","Tags","Shipping Phone","Shipping Street","Shipping City","Shipping Zip",
-        "Shipping Province","Shipping Country","Shipping Name","Shipping Company","Email",
-        "Name","Lineitem name","Lineitem quantity"
-    ]
-    for c in expected_cols:
+    for c in EXPECTED_COLS:
         if c not in orders_df.columns:
             orders_df[c] = ""
+    return orders_df
 
-    bundle_items = [
-        "CARB LOVER'S FEAST","SUPER CHARGED CALORIES","FEED ME BEEF","GIVE ME CHICKEN",
-        "I WON'T PAS(TA) ON THIS MEAL","THE MEGA PACK","MAKE YOUR OWN MEGA PACK",
-        "CARB HATERS FEAST","UNDER CHARGED CALORIES","VEGGIE LOVERS PACK","Clean Eats Meal Plan"
-    ]
-    family_double_items = ["Family Mac and 3 Cheese Pasta Bake","Baked Family Lasagna"]
-
+def build_manifest(orders_df: pd.DataFrame) -> pd.DataFrame:
     manifest_rows = []
     for name, group in orders_df.groupby("Name", sort=False):
         order = group.iloc[0]
@@ -88,20 +85,18 @@ def run():
                 qty = int(float(qty_raw))
             except:
                 qty = 0
-            if any(bundle in item for bundle in bundle_items):
+            if any(bundle in item for bundle in BUNDLE_ITEMS):
                 continue
-            elif item in family_double_items:
+            elif item in FAMILY_DOUBLE_ITEMS:
                 total_qty += qty * 2
             else:
                 total_qty += qty
 
         labels = math.ceil(total_qty / 24) if total_qty else 0
 
-        state_map = {"VIC": "Victoria","NSW":"New South Wales","ACT":"Australian Capital Territory"}
         country_map = {"AU":"Australia"}
-        raw_state = clean_cell(order["Shipping Province"])
+        raw_state = clean_cell(order["Shipping Province"]) or clean_cell(order.get("Shipping Province Name", ""))
         raw_country = clean_cell(order["Shipping Country"])
-        state = state_map.get(raw_state, raw_state)
         country = country_map.get(raw_country, raw_country)
 
         tags_blob = clean_cell(order["Tags"])
@@ -114,7 +109,7 @@ def run():
             "Address 1": clean_cell(order["Shipping Street"]),
             "Address 2": clean_cell(order["Shipping City"]),
             "Postal Code": to_clean_str(order["Shipping Zip"]),
-            "State": state,
+            "State": raw_state,
             "Country": country,
             "Deliver to": (clean_cell(order.get("Shipping Company", "")) or clean_cell(order.get("Shipping Name", ""))),
             "Phone No.": to_clean_str(format_phone(order["Shipping Phone"])),
@@ -126,8 +121,73 @@ def run():
             "Instructions": clean_cell(order["Notes"])
         })
 
-    manifest_df = pd.DataFrame(manifest_rows)
+    return pd.DataFrame(manifest_rows)
+
+def add_cartons_after_shipping_labels(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty or "No. of Shipping Labels" not in df.columns:
+        return df
+    df = df.copy()
+    if "Cartons" in df.columns:
+        df = df.drop(columns=["Cartons"])
+    insert_at = df.columns.get_loc("No. of Shipping Labels") + 1
+    df.insert(insert_at, "Cartons", df["No. of Shipping Labels"])
+    return df
+
+def build_dk_manifest(orders_df: pd.DataFrame, manifest_df: pd.DataFrame, dk_names: list) -> pd.DataFrame:
+    if len(dk_names) == 0:
+        return pd.DataFrame()
+    dk_src = orders_df[orders_df["Name"].isin(dk_names)]
+    dk_rows = []
+    today_mel = datetime.now(ZoneInfo("Australia/Melbourne")).date()
+    fallback_dk_date_str = (today_mel + timedelta(days=2)).strftime("%d/%m/%Y")
+
+    for order_name, group in dk_src.groupby("Name", sort=False):
+        order_name_clean = to_clean_str(order_name)
+        mrow = manifest_df[manifest_df["D.O. No."] == order_name_clean].iloc[0]
+        dk_date_str = clean_cell(mrow.get("Date", "")) or fallback_dk_date_str
+        code = order_name_clean.upper()
+        delivery_type = "Commercial" if code.startswith("CEW") else "Residential"
+
+        ship_company = clean_cell(group["Shipping Company"].iloc[0]) if len(group) else ""
+        ship_name = clean_cell(group["Shipping Name"].iloc[0]) if len(group) else ""
+        location = ship_company if ship_company else ship_name
+
+        email_vals = [clean_cell(x) for x in group["Email"].unique() if clean_cell(x)]
+        email = email_vals[0] if email_vals else ""
+
+        notes_vals = [clean_cell(x) for x in group["Notes"].unique() if clean_cell(x)]
+        notes_val = notes_vals[0] if notes_vals else ""
+
+        # DK wants the abbreviation; take it from the normalized manifest state
+        state_full = clean_cell(mrow["State"])
+        state_abbrev = STATE_CODES.get(state_full.upper(), state_full)
+
+        dk_rows.append({
+            "Order ID": order_name_clean,
+            "Date": dk_date_str,
+            "Time Window": "7am - 6pm",
+            "Notes": notes_val,
+            "Address 1": clean_cell(mrow["Address 1"]),
+            "Address 2": "",
+            "Address 3": "",
+            "Postal Code": to_clean_str(mrow["Postal Code"]),
+            "City": clean_cell(mrow["Address 2"]),
+            "State": state_abbrev,
+            "Country": "Australia",
+            "Location": location,
+            "Last Name": "",
+            "Phone": to_clean_str(mrow["Phone No."]),
+            "Delivery Instructions": clean_cell(mrow["Instructions"]),
+            "Email": email,
+            "DELIVERY TYPE": delivery_type,
+            "Volume": to_intish_str(mrow["No. of Shipping Labels"]),
+            "NOTES": ""
+        })
 
+    return pd.DataFrame(dk_rows)
+
+def split_by_carrier(orders_df: pd.DataFrame, manifest_df: pd.DataFrame) -> dict:
+    """Route manifest rows by order tag. Keys: CM, MC, CX, Other, DK."""
     tag_series = orders_df.groupby("Name")["Tags"].agg(lambda s: " ".join(map(clean_cell, s)))
     def names_with(tag): return tag_series[tag_series.str.contains(tag, na=False, case=False)].index.tolist()
 
@@ -139,24 +199,9 @@ def run():
     cx_manifest = manifest_df[manifest_df["D.O. No."].isin(cx_names)]
     other_manifest = manifest_df[~manifest_df["D.O. No."].isin(all_tagged_names)]
 
-    def add_cartons_after_shipping_labels(df: pd.DataFrame) -> pd.DataFrame:
-        if df.empty or "No. of Shipping Labels" not in df.columns:
-            return df
-        df = df.copy()
-        if "Cartons" in df.columns:
-            df = df.drop(columns=["Cartons"])
-        insert_at = df.columns.get_loc("No. of Shipping Labels") + 1
-        df.insert(insert_at, "Cartons", df["No. of Shipping Labels"])
-        return df
-
     # CM Logistics wants Cartons shown as its own column, immediately after Shipping Labels.
     cm_manifest = add_cartons_after_shipping_labels(cm_manifest)
 
-    def company_or_name(group: pd.DataFrame) -> str:
-        comp = clean_cell(group["Shipping Company"].iloc[0]) if len(group) else ""
-        name = clean_cell(group["Shipping Name"].iloc[0]) if len(group) else ""
-        return comp if comp else name
-
     if not mc_manifest.empty:
         # Future-proof (avoid GroupBy.apply behavior changes): prefer Shipping Company, else Shipping Name
         fb = orders_df.groupby("Name", sort=False)[["Shipping Company", "Shipping Name"]].first().fillna("")
@@ -164,6 +209,352 @@ def run():
         mc_manifest = mc_manifest.copy()
         mc_manifest["Deliver to"] = mc_manifest["D.O. No."].map(fallback).fillna("")
 
+    return {
+        "CM": cm_manifest,
+        "MC": mc_manifest,
+        "CX": cx_manifest,
+        "Other": other_manifest,
+        "DK": build_dk_manifest(orders_df, manifest_df, dk_names),
+    }
+
+def cx_template_path() -> Path:
+    template_path = Path(__file__).resolve().parent / "cx_manifest_template.xlsx"
+    if not template_path.exists():
+        template_path = Path("cx_manifest_template.xlsx")
+    return template_path
+
+def cx_delivery_date() -> str:
+    today_mel = datetime.now(ZoneInfo("Australia/Melbourne")).date()
+    return (today_mel + timedelta(days=1)).strftime("%d/%m/%Y")
+
+def cx_rows(cx_manifest: pd.DataFrame, orders_df: pd.DataFrame, cx_date_str: str):
+    """Yield one list of template column values (A..O) per CX order."""
+    # Shopify lookups (raw export)
+    addr1_lu = orders_df.groupby("Name")["Shipping Address1"].first().to_dict()
+    street_lu = orders_df.groupby("Name")["Shipping Street"].first().to_dict()
+    city_lu = orders_df.groupby("Name")["Shipping City"].first().to_dict()
+    notes_lu = orders_df.groupby("Name")["Notes"].first().to_dict()
+
+    for _, r in cx_manifest.iterrows():
+        order_name = to_clean_str(r.get("D.O. No.", ""))
+
+        inv_no = order_name
+        delivery_date = cx_date_str
+        store_no = ""
+        store_name = clean_cell(r.get("Deliver to", ""))
+
+        address = clean_cell(addr1_lu.get(order_name, "")) or clean_cell(street_lu.get(order_name, ""))
+        suburb = clean_cell(city_lu.get(order_name, ""))
+
+        # State/postcode already normalized against the reference table
+        state_full = clean_cell(r.get("State", ""))
+        postcode = clean_cell(r.get("Postal Code", ""))
+
+        cartons = int(r.get("No. of Shipping Labels", 0) or 0)
+
+        meals = float(r.get("Line Items", 0) or 0)
+        weight = round(meals * 0.380, 2)
+
+        inv_value = ""
+        cod = ""
+        pallets = ""
+        temp = "Chilled"
+        comment = clean_cell(notes_lu.get(order_name, ""))
+
+        yield [
+            inv_no, delivery_date, store_no, store_name, address, suburb, state_full, postcode,
+            cartons, pallets, weight, inv_value, cod, temp, comment
+        ]
+
+def spill_orders(uploaded_file, path: Path) -> Path:
+    """Stream the CSV in chunks into an Arrow IPC (Feather v2) file of cleaned string columns."""
+    writer = None
+    try:
+        for chunk in pd.read_csv(uploaded_file, dtype=str, keep_default_na=False, chunksize=BACKFILL_CHUNK_ROWS):
+            chunk = prepare_orders(chunk)
+            if writer is None:
+                schema = pa.schema([(c, pa.string()) for c in chunk.columns])
+                writer = pa.ipc.new_file(str(path), schema)
+            writer.write_table(pa.Table.from_pandas(chunk[schema.names], schema=schema, preserve_index=False))
+    finally:
+        if writer is not None:
+            writer.close()
+    return path
+
+def check_orders_contiguous(path: Path):
+    """Raise ValueError if any order's rows are not consecutive in the spilled file.
+
+    iter_order_batches() splits at order boundaries, so an order split across the export
+    (re-sorted or merged CSVs) would otherwise be written twice with partial quantities.
+    Only the Name column is read.
+    """
+    if not path.exists():
+        return
+    seen = set()
+    last = None
+    with pa.memory_map(str(path)) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            names = reader.get_batch(i).column("Name").to_pandas()
+            if names.empty:
+                continue
+            # First row of each run of identical names
+            starts = names[names != names.shift(fill_value=last)]
+            repeated = starts[starts.isin(seen) | starts.duplicated()]
+            if not repeated.empty:
+                raise ValueError(
+                    f"Order {repeated.iloc[0]} appears on non-consecutive rows of the export. "
+                    "Backfill mode needs each order's line items together - sort the CSV by Name "
+                    "or untick Backfill mode."
+                )
+            seen.update(starts)
+            last = names.iloc[-1]
+
+def iter_order_batches(path: Path):
+    """Yield memory-mapped record batches as frames of whole orders.
+
+    Each order's line items must be on consecutive rows (checked up front by
+    check_orders_contiguous), so only the last order of each batch can be incomplete;
+    it is carried into the next batch.
+    """
+    if not path.exists():
+        return
+    with pa.memory_map(str(path)) as source:
+        reader = pa.ipc.open_file(source)
+        carry = None
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i).to_pandas()
+            if carry is not None:
+                batch = pd.concat([carry, batch], ignore_index=True)
+            if batch.empty:
+                continue
+            names = batch["Name"].to_numpy()
+            cut = len(names)
+            while cut > 0 and names[cut - 1] == names[-1]:
+                cut -= 1
+            carry = batch.iloc[cut:]
+            if cut:
+                yield batch.iloc[:cut]
+        if carry is not None and not carry.empty:
+            yield carry
+
+class DiskSheetWriter:
+    """Append frames to an .xlsx on disk with xlsxwriter's constant_memory mode.
+
+    The workbook is created on the first non-empty write, so carriers with no orders
+    produce no file (same as add_to_zip_excel).
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.wb = None
+        self.ws = None
+        self.columns = None
+        self.row = 0
+
+    def write(self, df: pd.DataFrame):
+        if df.empty:
+            return
+        df = df.copy()
+        for col in TEXT_COLS:
+            if col in df.columns: df[col] = df[col].astype(str)
+        if self.wb is None:
+            self.wb = xlsxwriter.Workbook(str(self.path), {"constant_memory": True})
+            self.ws = self.wb.add_worksheet("Manifest")
+            self.columns = list(df.columns)
+            text_fmt = self.wb.add_format({'num_format': '@'})
+            for col in TEXT_COLS:
+                if col in self.columns:
+                    idx = self.columns.index(col)
+                    self.ws.set_column(idx, idx, None, text_fmt)
+            header_fmt = self.wb.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+            self.ws.write_row(0, 0, self.columns, header_fmt)
+            self.row = 1
+        values = df.reindex(columns=self.columns).astype(object)
+        values = values.where(values.notna(), "")
+        for record in values.to_numpy().tolist():
+            self.ws.write_row(self.row, 0, record)
+            self.row += 1
+
+    def close(self) -> bool:
+        if self.wb is None:
+            return False
+        self.wb.close()
+        return True
+
+BORDER_STYLES = {"thin": 1, "medium": 2, "dashed": 3, "dotted": 4, "thick": 5, "double": 6, "hair": 7}
+VALIGN = {"top": "top", "center": "vcenter", "bottom": "bottom", "justify": "vjustify", "distributed": "vdistributed"}
+
+class CxSheetWriter:
+    """Write the CX manifest from the template with xlsxwriter's constant_memory mode.
+
+    Used by both the normal and backfill paths; target is a file path or a BytesIO.
+    The template is only read to copy its header block (rows 1-5: values, merges, styles,
+    column widths); every data row takes the styles of the template's first data row, and
+    the template's cartons total is written on the row after the last order, over the
+    order rows only.
+    """
+
+    def __init__(self, target, cx_date_str: str, start_row: int = 6):
+        self.wb = xlsxwriter.Workbook(str(target) if isinstance(target, Path) else target, {"constant_memory": True})
+        self.formats = {}
+
+        template = load_workbook(cx_template_path())
+        ws_t = template["Sheet1"] if "Sheet1" in template.sheetnames else template.active
+        self.ws = self.wb.add_worksheet(ws_t.title)
+        if ws_t.sheet_view.zoomScale:
+            self.ws.set_zoom(ws_t.sheet_view.zoomScale)
+        for dim in ws_t.column_dimensions.values():
+            if dim.width:
+                self.ws.set_column(dim.min - 1, dim.max - 1, dim.width)
+
+        values = {"B3": "Clean Eats Australia", "B4": cx_date_str}  # B4 is merged B4:C4 in template
+        merges = {(m.min_row, m.min_col): m for m in ws_t.merged_cells.ranges}
+        merged = {(row, col) for m in ws_t.merged_cells.ranges for row, col in m.cells}
+        for row in ws_t.iter_rows(min_row=1, max_row=start_row - 1):
+            r = row[0].row
+            self.ws.set_row(r - 1, ws_t.row_dimensions[r].height)
+            for cell in row:
+                value = values.get(cell.coordinate, cell.value)
+                fmt = self._format(cell)
+                if (r, cell.column) in merges:
+                    m = merges[(r, cell.column)]
+                    self.ws.merge_range(m.min_row - 1, m.min_col - 1, m.max_row - 1, m.max_col - 1, value, fmt)
+                elif (r, cell.column) not in merged and (value is not None or cell.has_style):
+                    self.ws.write(r - 1, cell.column - 1, value, fmt)
+
+        # One default height instead of set_row() per data row, which xlsxwriter keeps in a dict
+        self.ws.set_default_row(ws_t.row_dimensions[start_row].height)
+        self.row_formats = [self._format(cell) for cell in ws_t[start_row]]
+        self.totals = [
+            (cell.column - 1, cell.value, self._format(cell))
+            for row in ws_t.iter_rows(min_row=start_row + 1) for cell in row
+            if isinstance(cell.value, str) and cell.value.startswith("=SUM(")
+        ]
+        self.start_row = start_row
+        self.extra_sheets = [name for name in template.sheetnames if name != ws_t.title]
+        template.close()
+        self.row = start_row - 1
+
+    def _format(self, cell):
+        font, fill, align = cell.font, cell.fill, cell.alignment
+        props = {"font_name": font.name, "font_size": font.sz, "bold": bool(font.b)}
+        if font.color is not None and font.color.type == "rgb":
+            props["font_color"] = "#" + font.color.rgb[-6:]
+        if fill.fill_type == "solid" and fill.fgColor.type == "rgb":
+            props["bg_color"] = "#" + fill.fgColor.rgb[-6:]
+        if cell.number_format != "General":
+            props["num_format"] = cell.number_format
+        if align.horizontal in ("left", "center", "right", "fill", "justify", "distributed"):
+            props["align"] = align.horizontal
+        if align.vertical in VALIGN:
+            props["valign"] = VALIGN[align.vertical]
+        for side in ("left", "right", "top", "bottom"):
+            style = getattr(cell.border, side).style
+            if style in BORDER_STYLES:
+                props[side] = BORDER_STYLES[style]
+        key = tuple(sorted(props.items(), key=lambda kv: kv[0]))
+        if key not in self.formats:
+            self.formats[key] = self.wb.add_format(props)
+        return self.formats[key]
+
+    def write(self, cx_manifest: pd.DataFrame, orders_df: pd.DataFrame, cx_date_str: str):
+        for values in cx_rows(cx_manifest, orders_df, cx_date_str):
+            for col, (val, fmt) in enumerate(zip(values, self.row_formats)):
+                self.ws.write(self.row, col, val, fmt)
+            self.row += 1
+
+    def close(self):
+        if self.row >= self.start_row:
+            for col, formula, fmt in self.totals:
+                letter = re.match(r"=SUM\(([A-Z]+)", formula).group(1)
+                self.ws.write_formula(self.row, col, f"=SUM({letter}{self.start_row}:{letter}{self.row})", fmt)
+        for name in self.extra_sheets:
+            self.wb.add_worksheet(name)
+        self.wb.close()
+
+def run_backfill(uploaded_file):
+    """Backfill mode: spill cleaned orders to disk and build every workbook batch by batch."""
+    with TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        orders_path = spill_orders(uploaded_file, tmp / "orders.arrow")
+        try:
+            check_orders_contiguous(orders_path)
+        except ValueError as e:
+            st.error(str(e))
+            return
+
+        filenames = {
+            "CM": "CM_Manifest.xlsx", "MC": "MC_Manifest.xlsx", "Other": "Other_Manifest.xlsx",
+            "DK": "DK_Manifest.xlsx", "Exceptions": "Address_Exceptions.xlsx",
+        }
+        writers = {key: DiskSheetWriter(tmp / name) for key, name in filenames.items()}
+        cx_writer = None
+        cx_date_str = cx_delivery_date()
+        exception_count = 0
+
+        for batch in iter_order_batches(orders_path):
+            manifest_df, address_exceptions = normalize_addresses(build_manifest(batch))
+            manifests = split_by_carrier(batch, manifest_df)
+            for key in ["CM", "MC", "Other", "DK"]:
+                writers[key].write(manifests[key])
+            writers["Exceptions"].write(address_exceptions)
+            exception_count += len(address_exceptions)
+            if not manifests["CX"].empty:
+                if cx_writer is None:
+                    cx_writer = CxSheetWriter(tmp / "CX_Manifest.xlsx", cx_date_str)
+                cx_writer.write(manifests["CX"], batch, cx_date_str)
+        orders_path.unlink(missing_ok=True)
+
+        written = {key: writers[key].close() for key in writers}
+        if cx_writer is not None:
+            cx_writer.close()
+
+        # Same file order as the in-memory path; zipf.write streams each workbook from disk
+        zip_path = tmp / "CleanEats_Manifests.zip"
+        with zipfile.ZipFile(zip_path, "w") as zipf:
+            for key in ["CM", "MC", "CX", "Other", "DK", "Exceptions"]:
+                if key == "CX":
+                    if cx_writer is not None:
+                        zipf.write(tmp / "CX_Manifest.xlsx", "CX_Manifest.xlsx")
+                elif written[key]:
+                    zipf.write(tmp / filenames[key], filenames[key])
+
+        if exception_count:
+            st.warning(f"{exception_count} order(s) failed address validation - see Address_Exceptions.xlsx in the ZIP.")
+
+        with open(zip_path, "rb") as f:
+            st.download_button(
+                label="Download Manifests ZIP",
+                data=f,
+                file_name="CleanEats_Manifests.zip",
+                mime="application/zip"
+            )
+
+def run():
+    st.markdown("### Clean Eats Manifest Generator")
+
+    uploaded_file = st.file_uploader("Upload Clean Eats orders_export CSV file", type="csv")
+    backfill = st.checkbox(
+        "Backfill mode (multi-week export)",
+        help="Spills orders to a temporary Arrow file and writes workbooks to disk so memory stays flat."
+    )
+    generate = st.button("Generate Clean Eats Manifests")
+
+    if not (uploaded_file and generate):
+        return
+
+    if backfill:
+        run_backfill(uploaded_file)
+        return
+
+    orders_df = prepare_orders(pd.read_csv(uploaded_file, dtype=str, keep_default_na=False))
+
+    manifest_df = build_manifest(orders_df)
+    # Postcode/state checked against the bundled reference in one join; failures go to Address_Exceptions.xlsx
+    manifest_df, address_exceptions = normalize_addresses(manifest_df)
+    manifests = split_by_carrier(orders_df, manifest_df)
+
     output = BytesIO()
     with zipfile.ZipFile(output, "w") as zipf:
         def add_to_zip_excel(df, filename):
@@ -171,135 +562,35 @@ def run():
             buffer = BytesIO()
             with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
                 df = df.copy()
-                for col in ["Phone No.","Postal Code"]:
+                for col in TEXT_COLS:
                     if col in df.columns: df[col] = df[col].astype(str)
                 df.to_excel(writer, index=False, sheet_name='Manifest')
                 wb = writer.book; ws = writer.sheets['Manifest']
                 text_fmt = wb.add_format({'num_format': '@'})
-                for col in ["Phone No.","Postal Code"]:
+                for col in TEXT_COLS:
                     if col in df.columns:
                         idx = df.columns.get_loc(col)
                         ws.set_column(idx, idx, None, text_fmt)
             zipf.writestr(filename, buffer.getvalue())
 
-        add_to_zip_excel(cm_manifest, "CM_Manifest.xlsx")
-        add_to_zip_excel(mc_manifest, "MC_Manifest.xlsx")
+        add_to_zip_excel(manifests["CM"], "CM_Manifest.xlsx")
+        add_to_zip_excel(manifests["MC"], "MC_Manifest.xlsx")
         # CX Cold Xpress (populate template)
-        if not cx_manifest.empty:
-            template_path = Path(__file__).resolve().parent / "cx_manifest_template.xlsx"
-            if not template_path.exists():
-                template_path = Path("cx_manifest_template.xlsx")
-            wb_cx = load_workbook(template_path)
-            ws_cx = wb_cx["Sheet1"] if "Sheet1" in wb_cx.sheetnames else wb_cx.active
-
-            today_mel = datetime.now(ZoneInfo("Australia/Melbourne")).date()
-            cx_date_str = (today_mel + timedelta(days=1)).strftime("%d/%m/%Y")
-
-            # Header cells
-            ws_cx["B3"] = "Clean Eats Australia"
-            ws_cx["B4"] = cx_date_str  # merged B4:C4 in template
-
-            # Shopify lookups (raw export)
-            addr1_lu = orders_df.groupby("Name")["Shipping Address1"].first().to_dict()
-            street_lu = orders_df.groupby("Name")["Shipping Street"].first().to_dict()
-            city_lu = orders_df.groupby("Name")["Shipping City"].first().to_dict()
-            zip_lu = orders_df.groupby("Name")["Shipping Zip"].first().to_dict()
-            prov_name_lu = orders_df.groupby("Name")["Shipping Province Name"].first().to_dict() if "Shipping Province Name" in orders_df.columns else {}
-            prov_lu = orders_df.groupby("Name")["Shipping Province"].first().to_dict()
-            notes_lu = orders_df.groupby("Name")["Notes"].first().to_dict()
-
-            start_row = 6
-            for row_idx, (_, r) in enumerate(cx_manifest.iterrows(), start=start_row):
-                order_name = to_clean_str(r.get("D.O. No.", ""))
-
-                inv_no = order_name
-                delivery_date = cx_date_str
-                store_no = ""
-                store_name = clean_cell(r.get("Deliver to", ""))
-
-                address = clean_cell(addr1_lu.get(order_name, "")) or clean_cell(street_lu.get(order_name, ""))
-                suburb = clean_cell(city_lu.get(order_name, ""))
-
-                state_full = clean_cell(prov_name_lu.get(order_name, "")) or clean_cell(prov_lu.get(order_name, ""))
-
-                raw_post = zip_lu.get(order_name, "")
-                postcode = re.sub(r"\D", "", str(raw_post))
-
-                cartons = int(r.get("No. of Shipping Labels", 0) or 0)
-
-                meals = float(r.get("Line Items", 0) or 0)
-                weight = round(meals * 0.380, 2)
-
-                inv_value = ""
-                cod = ""
-                pallets = ""
-                temp = "Chilled"
-                comment = clean_cell(notes_lu.get(order_name, ""))
-
-                values = [
-                    inv_no, delivery_date, store_no, store_name, address, suburb, state_full, postcode,
-                    cartons, pallets, weight, inv_value, cod, temp, comment
-                ]
-
-                for col_idx, val in enumerate(values, start=1):
-                    ws_cx.cell(row=row_idx, column=col_idx, value=val)
-
+        if not manifests["CX"].empty:
+            cx_date_str = cx_delivery_date()
             cx_buffer = BytesIO()
-            wb_cx.save(cx_buffer)
+            cx_writer = CxSheetWriter(cx_buffer, cx_date_str)
+            cx_writer.write(manifests["CX"], orders_df, cx_date_str)
+            cx_writer.close()
             zipf.writestr("CX_Manifest.xlsx", cx_buffer.getvalue())
-        add_to_zip_excel(other_manifest, "Other_Manifest.xlsx")
-
+        add_to_zip_excel(manifests["Other"], "Other_Manifest.xlsx")
         # DK Distribution (Excel now)
-        if len(dk_names) > 0:
-            dk_src = orders_df[orders_df["Name"].isin(dk_names)]
-            dk_rows = []
-            today_mel = datetime.now(ZoneInfo("Australia/Melbourne")).date()
-            fallback_dk_date_str = (today_mel + timedelta(days=2)).strftime("%d/%m/%Y")
-
-            for order_name, group in dk_src.groupby("Name", sort=False):
-                order_name_clean = to_clean_str(order_name)
-                mrow = manifest_df[manifest_df["D.O. No."] == order_name_clean].iloc[0]
-                dk_date_str = clean_cell(mrow.get("Date", "")) or fallback_dk_date_str
-                code = order_name_clean.upper()
-                delivery_type = "Commercial" if code.startswith("CEW") else "Residential"
-
-                ship_company = clean_cell(group["Shipping Company"].iloc[0]) if len(group) else ""
-                ship_name = clean_cell(group["Shipping Name"].iloc[0]) if len(group) else ""
-                location = ship_company if ship_company else ship_name
-
-                email_vals = [clean_cell(x) for x in group["Email"].unique() if clean_cell(x)]
-                email = email_vals[0] if email_vals else ""
-
-                notes_vals = [clean_cell(x) for x in group["Notes"].unique() if clean_cell(x)]
-                notes_val = notes_vals[0] if notes_vals else ""
-
-                state_vals = [clean_cell(x) for x in group["Shipping Province"].unique() if clean_cell(x)]
-                state_abbrev = state_vals[0] if state_vals else ""
-
-                dk_rows.append({
-                    "Order ID": order_name_clean,
-                    "Date": dk_date_str,
-                    "Time Window": "7am - 6pm",
-                    "Notes": notes_val,
-                    "Address 1": clean_cell(mrow["Address 1"]),
-                    "Address 2": "",
-                    "Address 3": "",
-                    "Postal Code": to_clean_str(mrow["Postal Code"]),
-                    "City": clean_cell(mrow["Address 2"]),
-                    "State": state_abbrev,
-                    "Country": "Australia",
-                    "Location": location,
-                    "Last Name": "",
-                    "Phone": to_clean_str(mrow["Phone No."]),
-                    "Delivery Instructions": clean_cell(mrow["Instructions"]),
-                    "Email": email,
-                    "DELIVERY TYPE": delivery_type,
-                    "Volume": to_intish_str(mrow["No. of Shipping Labels"]),
-                    "NOTES": ""
-                })
-
-            dk_df = pd.DataFrame(dk_rows)
-            add_to_zip_excel(dk_df, "DK_Manifest.xlsx")
+        add_to_zip_excel(manifests["DK"], "DK_Manifest.xlsx")
+
+        add_to_zip_excel(address_exceptions, "Address_Exceptions.xlsx")
+
+    if not address_exceptions.empty:
+        st.warning(f"{len(address_exceptions)} order(s) failed address validation - see Address_Exceptions.xlsx in the ZIP.")
 
     output.seek(0)
     st.download_button(
@@ -5,6 +5,7 @@ import zipfile
 from io import BytesIO
 import re
 from datetime import datetime
+from address_reference import normalize_addresses
 
 
 def run():
@@ -40,9 +41,7 @@ def run():
         phone = order.get("Shipping Phone")
         phone = format_phone(phone)
 
-        state_map = {"VIC": "Victoria", "NSW": "New South Wales"}
         country_map = {"AU": "Australia"}
-        state = state_map.get(order["Shipping Province"], order["Shipping Province"])
         country = country_map.get(order["Shipping Country"], order["Shipping Country"])
 
         date_match = re.search(r"\b(\d{2}/\d{2}/\d{4})\b", order.get("Tags", ""))
@@ -54,7 +53,7 @@ def run():
             "Address 1": order["Shipping Street"],
             "Address 2": order["Shipping City"],
             "Postal Code": str(order["Shipping Zip"]).replace("'", ""),
-            "State": state,
+            "State": order["Shipping Province"],
             "Country": country,
             "Deliver to": order["Shipping Name"],
             "Phone No.": phone,
@@ -67,6 +66,7 @@ def run():
         })
 
     manifest_df = pd.DataFrame(manifest_rows)
+    manifest_df, address_exceptions = normalize_addresses(manifest_df)
 
     output = BytesIO()
     with zipfile.ZipFile(output, "w") as zipf:
@@ -75,16 +75,23 @@ def run():
                 return
             buffer = BytesIO()
             with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-                df["Phone No."] = df["Phone No."].astype(str).str.replace(r"\.0$", "", regex=True)
+                if "Phone No." in df.columns:
+                    df["Phone No."] = df["Phone No."].astype(str).str.replace(r"\.0$", "", regex=True)
                 df.to_excel(writer, index=False, sheet_name='Manifest')
                 workbook = writer.book
                 worksheet = writer.sheets['Manifest']
                 text_fmt = workbook.add_format({'num_format': '@'})
-                col_index = df.columns.get_loc("Phone No.")
-                worksheet.set_column(col_index, col_index, None, text_fmt)
+                for col in ["Phone No.", "Postal Code"]:
+                    if col in df.columns:
+                        col_index = df.columns.get_loc(col)
+                        worksheet.set_column(col_index, col_index, None, text_fmt)
             zipf.writestr(filename, buffer.getvalue())
 
         add_to_zip(manifest_df, "EliteMeals_Manifest.xlsx")
+        add_to_zip(address_exceptions, "Address_Exceptions.xlsx")
+
+    if not address_exceptions.empty:
+        st.warning(f"{len(address_exceptions)} order(s) failed address validation - see Address_Exceptions.xlsx in the ZIP.")
 
     output.seek(0)
     st.download_button(
@@ -6,6 +6,7 @@ from io import BytesIO
 import re
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
+from address_reference import normalize_addresses, STATE_CODES
 
 NAN_LIKE = {"nan", "none", "null", ""}
 
@@ -94,11 +95,9 @@ def run():
 
         labels = math.ceil(total_qty / 20) if total_qty else 0
 
-        state_map = {"VIC": "Victoria", "NSW": "New South Wales", "ACT": "Australian Capital Territory"}
         country_map = {"AU": "Australia"}
-        raw_state = clean_cell(order["Shipping Province"])
+        raw_state = clean_cell(order["Shipping Province"]) or clean_cell(order.get("Shipping Province Name", ""))
         raw_country = clean_cell(order["Shipping Country"])
-        state = state_map.get(raw_state, raw_state)
         country = country_map.get(raw_country, raw_country)
 
         tags_blob = clean_cell(order["Tags"])
@@ -111,7 +110,7 @@ def run():
             "Address 1": clean_cell(order["Shipping Street"]),
             "Address 2": clean_cell(order["Shipping City"]),
             "Postal Code": to_clean_str(order["Shipping Zip"]),
-            "State": state,
+            "State": raw_state,
             "Country": country,
             "Deliver to": clean_cell(order["Shipping Name"]),
             "Phone No.": to_clean_str(format_phone(order["Shipping Phone"])),
@@ -124,6 +123,8 @@ def run():
         })
 
     manifest_df = pd.DataFrame(manifest_rows)
+    # Postcode/state checked against the bundled reference in one join; failures go to Address_Exceptions.xlsx
+    manifest_df, address_exceptions = normalize_addresses(manifest_df)
 
     # Tag collection for routing
     tag_series = orders_df.groupby("Name")["Tags"].agg(lambda s: " ".join(map(clean_cell, s)))
@@ -206,8 +207,9 @@ def run():
                 notes_vals = [clean_cell(x) for x in group["Notes"].unique() if clean_cell(x)]
                 notes_val = notes_vals[0] if notes_vals else ""
 
-                state_vals = [clean_cell(x) for x in group["Shipping Province"].unique() if clean_cell(x)]
-                state_abbrev = state_vals[0] if state_vals else ""
+                # DK wants the abbreviation; take it from the normalized manifest state
+                state_full = clean_cell(mrow["State"])
+                state_abbrev = STATE_CODES.get(state_full.upper(), state_full)
 
                 dk_rows.append({
                     "Order ID": order_name_clean,
@@ -238,6 +240,11 @@ def run():
             ])
             add_to_zip_excel(dk_df, "DK_Manifest.xlsx")
 
+        add_to_zip_excel(address_exceptions, "Address_Exceptions.xlsx")
+
+    if not address_exceptions.empty:
+        st.warning(f"{len(address_exceptions)} order(s) failed address validation - see Address_Exceptions.xlsx in the ZIP.")
+
     output.seek(0)
     st.download_button(
         label="Download Manifests ZIP",